@@ -19,8 +19,12 @@
 
 import os
 import sys
+from collections import defaultdict
 from collections.abc import Iterable
-from typing import NoReturn, Optional
+from typing import NoReturn
+
+from psycopg2.extras import execute_values
+from sqlalchemy import or_, sql
 
 from daklib.dbconn import DBConn, Fingerprint, Keyring, Suite, Uid, ACL
 
@@ -55,127 +59,208 @@ def usage(status: int = 0) -> NoReturn:
     sys.exit(status)
 
 
-def get_fingerprint(entry: str, session) -> Optional[Fingerprint]:
-    """get fingerprint for given ACL entry
+def get_fingerprints(entries: Iterable[str], session) -> dict[str, list[Fingerprint]]:
+    """get fingerprints for given ACL entries
 
-    The entry is a string in one of these formats::
+    Each entry is a string in one of these formats::
 
         uid:<uid>
         name:<name>
         fpr:<fingerprint>
         keyring:<keyring-name>
 
-    :param entry: ACL entry
+    Entries are grouped by selector so that only one query per selector
+    is issued.
+
+    :param entries: ACL entries
     :param session: database session
-    :return: fingerprint for the entry
+    :return: mapping of each entry to the fingerprints it selects
     """
-    field, value = entry.split(":", 1)
-    q = session.query(Fingerprint).join(Fingerprint.keyring).filter(Keyring.active == True)  # noqa:E712
-
-    if field == 'uid':
-        q = q.join(Fingerprint.uid).filter(Uid.uid == value)
-    elif field == 'name':
-        q = q.join(Fingerprint.uid).filter(Uid.name == value)
-    elif field == 'fpr':
-        q = q.filter(Fingerprint.fingerprint == value)
-    elif field == 'keyring':
-        q = q.filter(Keyring.keyring_name == value)
-    else:
-        raise Exception('Unknown selector "{0}".'.format(field))
+    columns = {
+        'uid': Uid.uid,
+        'name': Uid.name,
+        'fpr': Fingerprint.fingerprint,
+        'keyring': Keyring.keyring_name,
+    }
+
+    result: dict[str, list[Fingerprint]] = {}
+    by_field: dict[str, dict[str, str]] = defaultdict(dict)
+    for entry in entries:
+        field, value = entry.split(":", 1)
+        if field not in columns:
+            raise Exception('Unknown selector "{0}".'.format(field))
+        by_field[field][value] = entry
+        result[entry] = []
 
-    return q.all()
+    for field, values in by_field.items():
+        column = columns[field]
+        q = session.query(column, Fingerprint).select_from(Fingerprint) \
+            .join(Fingerprint.keyring).filter(Keyring.active == True)  # noqa:E712
+        if field in ('uid', 'name'):
+            q = q.join(Fingerprint.uid)
+        q = q.filter(column.in_(list(values)))
 
+        for value, fingerprint in q:
+            result[values[value]].append(fingerprint)
 
-def acl_set_fingerprints(acl_name: str, entries: Iterable[str]) -> None:
-    session = DBConn().session()
+    return result
+
+
+def get_suite_ids(suites: Iterable[str], session) -> dict[str, int]:
+    """get suite ids for the given suite names or codenames
+
+    :param suites: suite names or codenames
+    :param session: database session
+    :return: mapping of each given name to its suite id
+    """
+    suites = list(suites)
+    rows = session.query(Suite.suite_id, Suite.suite_name, Suite.codename) \
+        .filter(or_(Suite.suite_name.in_(suites), Suite.codename.in_(suites))).all()
+
+    # suite names take precedence over codenames
+    id_map = {codename: suite_id for suite_id, suite_name, codename in rows if codename}
+    id_map.update({suite_name: suite_id for suite_id, suite_name, codename in rows})
+
+    for suite in suites:
+        if suite not in id_map:
+            raise Exception('Unknown suite "{0}".'.format(suite))
+
+    return id_map
+
+
+def get_acl_and_fingerprint_ids(acl_name: str, fingerprint: str, session) -> tuple[int, int]:
+    """get ids of an ACL and a fingerprint with a single query
+
+    :param acl_name: name of the ACL
+    :param fingerprint: fingerprint
+    :param session: database session
+    :return: tuple of ACL id and fingerprint id
+    """
+    query = """
+      SELECT
+        (SELECT id FROM acl WHERE name = :acl_name),
+        (SELECT id FROM fingerprint WHERE fingerprint = :fingerprint)
+      """
+    acl_id, fingerprint_id = session.execute(query, {'acl_name': acl_name, 'fingerprint': fingerprint}).one()
+
+    if acl_id is None:
+        raise Exception('Unknown ACL "{0}".'.format(acl_name))
+    if fingerprint_id is None:
+        raise Exception('Unknown fingerprint "{0}".'.format(fingerprint))
+
+    return acl_id, fingerprint_id
+
+
+def insert_rows(session, table, rows: list[dict]) -> None:
+    """insert rows into a table with as few statements as possible
+
+    On psycopg2 the rows are sent with :func:`psycopg2.extras.execute_values`,
+    which avoids having SQLAlchemy compile one large statement.  Other
+    drivers get a single multi-row INSERT.
+
+    :param session: database session
+    :param table: table to insert into
+    :param rows: rows to insert; all rows must have the same keys
+    """
+    if not rows:
+        return
+
+    connection = session.connection()
+    if connection.dialect.driver == 'psycopg2':
+        columns = list(rows[0])
+        statement = "INSERT INTO {0} ({1}) VALUES %s".format(table.name, ", ".join(columns))
+        with connection.connection.cursor() as cursor:
+            execute_values(cursor, statement, [tuple(row[c] for c in columns) for row in rows], page_size=1000)
+    else:
+        session.execute(table.insert().values(rows))
+
+
+def acl_set_fingerprints(acl_name: str, entries: Iterable[str], session) -> None:
     acl = session.query(ACL).filter_by(name=acl_name).one()
 
-    acl.fingerprints.clear()
+    selectors = []
     for entry in entries:
         entry = entry.strip()
         if entry.startswith('#') or len(entry) == 0:
             continue
+        selectors.append(entry)
 
-        fps = get_fingerprint(entry, session)
+    fingerprints = set()
+    for entry, fps in get_fingerprints(selectors, session).items():
         if len(fps) == 0:
             print("Unknown key for '{0}'".format(entry))
         else:
-            acl.fingerprints.update(fps)
+            fingerprints.update(fps)
 
-    session.commit()
+    # only touch the rows that actually change
+    current = set(acl.fingerprints)
+    acl.fingerprints.difference_update(current - fingerprints)
+    acl.fingerprints.update(fingerprints - current)
 
 
-def acl_export_per_source(acl_name: str) -> None:
-    session = DBConn().session()
-    acl = session.query(ACL).filter_by(name=acl_name).one()
+def acl_export_per_source(acl_name: str, session) -> None:
+    acl_id, = session.query(ACL.id).filter_by(name=acl_name).one()
 
     query = r"""
       SELECT
         f.fingerprint,
-        (SELECT COALESCE(u.name, '') || ' <' || u.uid || '>'
-           FROM uid u
-           JOIN fingerprint f2 ON u.id = f2.uid
-          WHERE f2.id = f.id) AS name,
+        COALESCE(u.name, '') || ' <' || u.uid || '>' AS name,
         STRING_AGG(
           a.source
-          || COALESCE(' (' || (SELECT fingerprint FROM fingerprint WHERE id = a.created_by_id) || ')', ''),
+          || COALESCE(' (' || cb.fingerprint || ')', ''),
           E',\n ' ORDER BY a.source)
       FROM acl_per_source a
       JOIN fingerprint f ON a.fingerprint_id = f.id
       LEFT JOIN uid u ON f.uid = u.id
+      LEFT JOIN fingerprint cb ON a.created_by_id = cb.id
       WHERE a.acl_id = :acl_id
-      GROUP BY f.id, f.fingerprint
+      GROUP BY f.id, f.fingerprint, u.id
       ORDER BY name
       """
 
-    for row in session.execute(query, {'acl_id': acl.id}):
+    # stream the rows so large ACLs are not loaded into memory at once;
+    # the session's connection is already open at this point, so the
+    # option has to be set on the connection returned here
+    connection = session.connection().execution_options(stream_results=True)
+    for row in connection.execute(sql.text(query), {'acl_id': acl_id}):
         print("Fingerprint:", row[0])
         print("Uid:", row[1])
         print("Allow:", row[2])
         print()
 
-    session.rollback()
-    session.close()
-
 
-def acl_export_per_suite(acl_name: str) -> None:
-    session = DBConn().session()
-    acl = session.query(ACL).filter_by(name=acl_name).one()
+def acl_export_per_suite(acl_name: str, session) -> None:
+    acl_id, = session.query(ACL.id).filter_by(name=acl_name).one()
 
     query = r"""
       SELECT
         f.fingerprint,
-        (SELECT COALESCE(u.name, '') || ' <' || u.uid || '>'
-           FROM uid u
-           JOIN fingerprint f2 ON u.id = f2.uid
-          WHERE f2.id = f.id) AS name,
+        COALESCE(u.name, '') || ' <' || u.uid || '>' AS name,
         s.suite_name
       FROM acl_per_suite a
       JOIN fingerprint f ON a.fingerprint_id = f.id
       JOIN suite s ON a.suite_id = s.id
       LEFT JOIN uid u ON f.uid = u.id
       WHERE a.acl_id = :acl_id
-      GROUP BY f.id, f.fingerprint, s.suite_name
+      GROUP BY f.id, f.fingerprint, u.id, s.suite_name
       ORDER BY name
       """
 
-    for row in session.execute(query, {'acl_id': acl.id}):
+    # stream the rows so large ACLs are not loaded into memory at once;
+    # the session's connection is already open at this point, so the
+    # option has to be set on the connection returned here
+    connection = session.connection().execution_options(stream_results=True)
+    for row in connection.execute(sql.text(query), {'acl_id': acl_id}):
         print("Fingerprint:", row[0])
         print("Uid:", row[1])
         print("Allow:", row[2])
         print()
 
-    session.rollback()
-    session.close()
 
-
-def acl_allow(acl_name: str, fingerprint: str, sources: Iterable[str]) -> None:
+def acl_allow(acl_name: str, fingerprint: str, sources: Iterable[str], session) -> None:
     tbl = DBConn().tbl_acl_per_source
 
-    session = DBConn().session()
-
-    acl_id = session.query(ACL).filter_by(name=acl_name).one().id
-    fingerprint_id = session.query(Fingerprint).filter_by(fingerprint=fingerprint).one().fingerprint_id
+    acl_id, fingerprint_id = get_acl_and_fingerprint_ids(acl_name, fingerprint, session)
 
     # TODO: check that fpr is in ACL
 
@@ -189,80 +274,63 @@ def acl_allow(acl_name: str, fingerprint: str, sources: Iterable[str]) -> None:
         for source in sources
     ]
 
-    session.execute(tbl.insert(), data)
-
-    session.commit()
+    insert_rows(session, tbl, data)
 
 
-def acl_allow_suite(acl_name: str, fingerprint: str, suites: Iterable[str]) -> None:
+def acl_allow_suite(acl_name: str, fingerprint: str, suites: Iterable[str], session) -> None:
     tbl = DBConn().tbl_acl_per_suite
 
-    session = DBConn().session()
-
-    acl_id = session.query(ACL).filter_by(name=acl_name).one().id
-    fingerprint_id = session.query(Fingerprint).filter_by(fingerprint=fingerprint).one().fingerprint_id
+    acl_id, fingerprint_id = get_acl_and_fingerprint_ids(acl_name, fingerprint, session)
 
     # TODO: check that fpr is in ACL
 
-    data = []
-
-    for suite in suites:
-        try:
-            suite_id = session.query(Suite).filter_by(suite_name=suite).one().suite_id
-        except:
-            suite_id = session.query(Suite).filter_by(codename=suite).one().suite_id
+    id_map = get_suite_ids(suites, session)
 
-        data.append({
+    data = [
+        {
             'acl_id': acl_id,
             'fingerprint_id': fingerprint_id,
-            'suite_id': suite_id,
+            'suite_id': id_map[suite],
             'reason': 'set by {} via CLI'.format(os.environ.get('USER', '(unknown)')),
-        })
-
-    session.execute(tbl.insert(), data)
+        }
+        for suite in suites
+    ]
 
-    session.commit()
+    insert_rows(session, tbl, data)
 
 
-def acl_deny(acl_name: str, fingerprint: str, sources: Iterable[str]) -> None:
+def acl_deny(acl_name: str, fingerprint: str, sources: Iterable[str], session) -> None:
     tbl = DBConn().tbl_acl_per_source
 
-    session = DBConn().session()
-
-    acl_id = session.query(ACL).filter_by(name=acl_name).one().id
-    fingerprint_id = session.query(Fingerprint).filter_by(fingerprint=fingerprint).one().fingerprint_id
+    acl_id, fingerprint_id = get_acl_and_fingerprint_ids(acl_name, fingerprint, session)
 
     # TODO: check that fpr is in ACL
 
+    result = session.execute(tbl.delete().where(tbl.c.acl_id == acl_id).where(tbl.c.fingerprint_id == fingerprint_id).where(tbl.c.source.in_(sources)).returning(tbl.c.source))
+    deleted = {row[0] for row in result}
+
     for source in sources:
-        result = session.execute(tbl.delete().where(tbl.c.acl_id == acl_id).where(tbl.c.fingerprint_id == fingerprint_id).where(tbl.c.source == source))
-        if result.rowcount < 1:
+        if source not in deleted:
             print("W: Tried to deny uploads of '{}', but was not allowed before.".format(source))
 
-    session.commit()
 
-
-def acl_deny_suite(acl_name: str, fingerprint: str, suites: Iterable[str]) -> None:
+def acl_deny_suite(acl_name: str, fingerprint: str, suites: Iterable[str], session) -> None:
     tbl = DBConn().tbl_acl_per_suite
 
-    session = DBConn().session()
-
-    acl_id = session.query(ACL).filter_by(name=acl_name).one().id
-    fingerprint_id = session.query(Fingerprint).filter_by(fingerprint=fingerprint).one().fingerprint_id
+    acl_id, fingerprint_id = get_acl_and_fingerprint_ids(acl_name, fingerprint, session)
 
     # TODO: check that fpr is in ACL
 
-    for suite in suites:
-        try:
-            suite_id = session.query(Suite).filter_by(suite_name=suite).one().suite_id
-        except:
-            suite_id = session.query(Suite).filter_by(codename=suite).one().suite_id
+    id_map = get_suite_ids(suites, session)
 
-        result = session.execute(tbl.delete().where(tbl.c.acl_id == acl_id).where(tbl.c.fingerprint_id == fingerprint_id).where(tbl.c.suite_id == suite_id))
-        if result.rowcount < 1:
-            print("W: Tried to deny uploads for suite '{}', but was not allowed before.".format(suite))
+    suite_ids = list({id_map[suite] for suite in suites})
+
+    result = session.execute(tbl.delete().where(tbl.c.acl_id == acl_id).where(tbl.c.fingerprint_id == fingerprint_id).where(tbl.c.suite_id.in_(suite_ids)).returning(tbl.c.suite_id))
+    deleted = {row[0] for row in result}
 
-    session.commit()
+    for suite in suites:
+        if id_map[suite] not in deleted:
+            print("W: Tried to deny uploads for suite '{}', but was not allowed before.".format(suite))
 
 
 def main(argv=None):
@@ -275,19 +343,24 @@ def main(argv=None):
     if len(argv) < 3:
         usage(1)
 
-    if argv[1] == 'set-fingerprints':
-        acl_set_fingerprints(argv[2], sys.stdin)
-    elif argv[1] == 'export-per-source':
-        acl_export_per_source(argv[2])
-    elif argv[1] == 'export-per-suite':
-        acl_export_per_suite(argv[2])
-    elif argv[1] == 'allow':
-        acl_allow(argv[2], argv[3], argv[4:])
-    elif argv[1] == 'deny':
-        acl_deny(argv[2], argv[3], argv[4:])
-    elif argv[1] == 'allow-suite':
-        acl_allow_suite(argv[2], argv[3], argv[4:])
-    elif argv[1] == 'deny-suite':
-        acl_deny_suite(argv[2], argv[3], argv[4:])
-    else:
-        usage(1)
+    session = DBConn().session()
+    try:
+        if argv[1] == 'set-fingerprints':
+            acl_set_fingerprints(argv[2], sys.stdin, session)
+        elif argv[1] == 'export-per-source':
+            acl_export_per_source(argv[2], session)
+        elif argv[1] == 'export-per-suite':
+            acl_export_per_suite(argv[2], session)
+        elif argv[1] == 'allow':
+            acl_allow(argv[2], argv[3], argv[4:], session)
+        elif argv[1] == 'deny':
+            acl_deny(argv[2], argv[3], argv[4:], session)
+        elif argv[1] == 'allow-suite':
+            acl_allow_suite(argv[2], argv[3], argv[4:], session)
+        elif argv[1] == 'deny-suite':
+            acl_deny_suite(argv[2], argv[3], argv[4:], session)
+        else:
+            usage(1)
+        session.commit()
+    finally:
+        session.close()
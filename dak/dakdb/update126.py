@@ -49,6 +49,11 @@ def do_update(self):
 
         c = self.db.cursor()
 
+        # The whole update is one transaction; a crash before the WAL is
+        # flushed loses it together with the db_revision bump, so the
+        # update is simply applied again.
+        c.execute("SET LOCAL synchronous_commit = off")
+
         for stmt in statements:
             c.execute(stmt)
 
@@ -47,7 +47,7 @@ import apt_pkg
 from pathlib import Path
 
 from daklib.config import Config
-from daklib.dbconn import DBConn, DBSource
+from daklib.dbconn import DBBinary, DBConn, DBSource, PoolFile
 from daklib import utils
 
 ################################################################################
@@ -91,15 +91,16 @@ def main():
     if pkg is None:
         utils.fubar(f"Source {source} at version {version} does not exist")
 
-    filenames = []
-
     # Don't include pool otherwise we have to work out components (which may vary
     # by archive).  The partial path is enough for rsync to match it
-    for binary in pkg.binaries:
-        filenames.append(binary.poolfile.filename)
+    q = session.query(PoolFile.filename).select_from(DBBinary) \
+        .join(DBBinary.poolfile) \
+        .filter(DBBinary.source_id == pkg.source_id)
+
+    filenames = sorted(filename for filename, in q)
 
-    for filename in sorted(filenames):
-        print(filename)
+    if filenames:
+        sys.stdout.write("\n".join(filenames) + "\n")
 
 ######################################################################################
 
@@ -484,7 +484,7 @@ def process_queue(queue, log, rrd_dir):
             for arch in dbc.architecture.split():
                 arches.add(arch)
             versions.add(dbc.version)
-        arches_list = sorted(arches, key=utils.ArchKey)
+        arches_list = sorted(arches, key=utils.arch_sort_key)
         arch_list = " ".join(arches_list)
         version_list = " ".join(sorted(versions, reverse=True))
         if len(version_list) > max_version_len:
@@ -364,7 +364,7 @@ def main():
     for package in removals:
         versions = sorted(d[package], key=functools.cmp_to_key(apt_pkg.version_compare))
         for version in versions:
-            d[package][version].sort(key=utils.ArchKey)
+            d[package][version].sort(key=utils.arch_sort_key)
             summary += "%10s | %10s | %s\n" % (package, version, ", ".join(d[package][version]))
     print("Will remove the following packages from %s:" % (suites_list))
     print()
@@ -29,6 +29,7 @@ Display, edit and check the release manager's transition file.
 ################################################################################
 
 import os
+import shlex
 import subprocess
 import sys
 import time
@@ -329,14 +330,14 @@ def temp_transitions_file(transitions: dict) -> str:
 
     .. note::
 
-       file is unlinked by caller, but fd is never actually closed.
+       file is unlinked by caller.
        We need the chmod, as the file is (most possibly) copied from a
        sudo-ed script and would be unreadable if it has default mkstemp mode
     """
 
     (fd, path) = tempfile.mkstemp("", "transitions", Cnf["Dir::TempPath"])
-    os.chmod(path, 0o644)
-    with open(path, "w") as f:
+    os.fchmod(fd, 0o644)
+    with os.fdopen(fd, "w") as f:
         yaml.safe_dump(transitions, f, default_flow_style=False)
     return path
 
@@ -351,8 +352,12 @@ def edit_transitions():
     editor = os.environ.get("EDITOR", "vi")
 
     while True:
-        result = os.system("%s %s" % (editor, edit_file))
-        if result != 0:
+        try:
+            returncode = subprocess.run(shlex.split(editor) + [edit_file]).returncode
+        except OSError:
+            # e.g. $EDITOR does not exist or is not executable
+            returncode = 127
+        if returncode != 0:
             os.unlink(edit_file)
             utils.fubar("%s invocation failed for %s, not removing tempfile." % (editor, edit_file))
 
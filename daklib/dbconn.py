@@ -55,7 +55,7 @@ from sqlalchemy.ext.associationproxy import association_proxy
 
 # Don't remove this, we re-export the exceptions to scripts which import us
 from sqlalchemy.exc import *
-from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 
 import daklib.gpg
 from .aptversion import AptVersion
@@ -1659,26 +1659,51 @@ def get_suite(suite: str, session=None) -> Optional[Suite]:
     :return: Suite object for the requested suite name (None if not present)
     """
 
-    # Start by looking for the dak internal name
-    q = session.query(Suite).filter_by(suite_name=suite)
-    try:
-        return q.one()
-    except NoResultFound:
-        pass
+    return get_suites([suite], session=session).get(suite)
 
-    # Now try codename
-    q = session.query(Suite).filter_by(codename=suite)
-    try:
-        return q.one()
-    except NoResultFound:
-        pass
 
-    # Finally give release_suite a try
-    q = session.query(Suite).filter_by(release_suite=suite)
-    return q.one_or_none()
+__all__.append('get_suite')
 
 
-__all__.append('get_suite')
+@session_wrapper
+def get_suites(suites: Iterable[str], session=None) -> dict[str, Suite]:
+    """
+    Returns Suite objects for several `suites` names in one query.
+
+    Names are resolved like :func:`get_suite` does.
+
+    :param suites: The names of the suites
+    :param session: Optional SQLA session object (a temporary one will be
+       generated if not supplied)
+    :return: dict mapping each known name to its Suite object
+    """
+
+    suites = list(suites)
+    if not suites:
+        return {}
+
+    q = session.query(Suite).filter(sqlalchemy.or_(
+        Suite.suite_name.in_(suites),
+        Suite.codename.in_(suites),
+        Suite.release_suite.in_(suites)))
+    candidates = q.all()
+
+    result = {}
+    for suite in suites:
+        # Prefer the dak internal name, then the codename and finally the
+        # release_suite
+        for attribute in ('suite_name', 'codename', 'release_suite'):
+            matches = [s for s in candidates if getattr(s, attribute) == suite]
+            if len(matches) > 1:
+                raise MultipleResultsFound("Multiple rows were found for {0} '{1}'".format(attribute, suite))
+            if matches:
+                result[suite] = matches[0]
+                break
+
+    return result
+
+
+__all__.append('get_suites')
 
 ################################################################################
 
@@ -182,6 +182,8 @@ class SignedFile:
 
         read_lines = dict((fd, []) for fd in read)
         write_pos = dict((fd, 0) for fd in write)
+        # Slicing a memoryview does not copy the not yet written data
+        write_data = dict((fd, memoryview(data)) for fd, data in write.items())
 
         read_set = list(read)
         write_set = list(write)
@@ -194,7 +196,7 @@ class SignedFile:
                 else:
                     read_lines[fd].append(data)
             for fd in w:
-                data = write[fd][write_pos[fd]:]
+                data = write_data[fd][write_pos[fd]:]
                 if len(data) == 0:
                     os.close(fd)
                     write_set.remove(fd)
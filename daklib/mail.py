@@ -6,11 +6,39 @@
 
 import daklib.gpg
 
+import contextlib
 import email
 import email.message
+import email.parser
 import email.policy
+import re
+import smtplib
 
-from typing import cast
+from collections.abc import Iterator
+from typing import Optional, cast
+
+# Parsers only hold the message factory and policy, so they can be shared
+# between calls.
+_parser = email.parser.Parser(policy=email.policy.SMTPUTF8)
+_bytes_parser = email.parser.BytesParser(policy=email.policy.SMTPUTF8)
+
+
+def _canonical_bytes(part: email.message.MIMEPart) -> bytes:
+    """serialize a non-multipart MIME part in canonical (CRLF) form
+
+    The result must be identical to ``part.as_bytes(policy=email.policy.SMTP)``
+    as it is what gets signed.  Headers are folded by the policy just like
+    the generator does; for an ASCII payload the body is assembled directly
+    instead of running the generator.
+    """
+    if part.is_multipart():
+        return part.as_bytes(policy=email.policy.SMTP)
+    payload = part.get_payload()
+    if not payload.isascii():
+        return part.as_bytes(policy=email.policy.SMTP)
+    headers = b"".join(email.policy.SMTP.fold_binary(name, value) for name, value in part.raw_items())
+    body = re.sub(r"\r\n|\r|\n", "\r\n", payload)
+    return headers + b"\r\n" + body.encode("ascii")
 
 
 def sign_mail(msg: email.message.EmailMessage, *, digest_algorithm: str = "SHA256", **kwargs) -> email.message.EmailMessage:
@@ -23,7 +51,7 @@ def sign_mail(msg: email.message.EmailMessage, *, digest_algorithm: str = "SHA25
     # Copy Content-Transfer-Encoding from unsigned message
     del mime_data["Content-Transfer-Encoding"]
     mime_data["Content-Transfer-Encoding"] = msg["Content-Transfer-Encoding"]
-    data = mime_data.as_bytes(policy=email.policy.SMTP)
+    data = _canonical_bytes(mime_data)
 
     sig = daklib.gpg.sign(data, **kwargs, digest_algorithm=digest_algorithm)
     mime_sig = email.message.MIMEPart()
@@ -40,9 +68,36 @@ def sign_mail(msg: email.message.EmailMessage, *, digest_algorithm: str = "SHA25
 # TODO [python3.10, pep604]:
 # def parse_mail(msg: bytes | str) -> email.message.EmailMessage:
 def parse_mail(msg) -> email.message.EmailMessage:
+    # We need a cast as the return type depends on the `policy` argument.
     if isinstance(msg, str):
-        # We need a cast as the return type depends on the `policy` argument.
-        return cast(email.message.EmailMessage, email.message_from_string(msg, policy=email.policy.SMTPUTF8))
+        # Do not round-trip through bytes: 8-bit text in a message without
+        # a charset parameter would then be decoded as us-ascii.
+        return cast(email.message.EmailMessage, _parser.parsestr(msg))
+    else:
+        return cast(email.message.EmailMessage, _bytes_parser.parsebytes(msg))
+
+
+@contextlib.contextmanager
+def get_sendmail_channel(address: Optional[str]) -> Iterator[Optional[smtplib.SMTP]]:
+    """open a connection to the MTA that can be used for several mails
+
+    :param address: path of an LMTP unix socket (if it starts with "/") or
+                    "host[:port]" of an SMTP server. If empty or :const:`None`,
+                    no connection is opened and :const:`None` is returned.
+    """
+    if not address:
+        yield None
+        return
+
+    if address.startswith("/"):
+        channel: smtplib.SMTP = smtplib.LMTP(address)
     else:
-        # We need a cast as the return type depends on the `policy` argument.
-        return cast(email.message.EmailMessage, email.message_from_bytes(msg, policy=email.policy.SMTPUTF8))
+        channel = smtplib.SMTP(address)
+    try:
+        yield channel
+    finally:
+        try:
+            channel.quit()
+        except smtplib.SMTPException:
+            # do not hide an error raised while sending
+            channel.close()
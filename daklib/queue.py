@@ -25,6 +25,9 @@ Queue utility functions for dak
 
 ###############################################################################
 
+from collections import defaultdict
+from collections.abc import Iterable
+
 from . import utils
 
 from .regexes import *
@@ -54,14 +57,20 @@ def check_valid(overrides: list[dict], session) -> bool:
     :return: :const:`True` if all overrides are valid, :const:`False` if there is any
              invalid override.
     """
+    # priorities and sections are small tables: fetch them once instead
+    # of querying for every override
+    priorities = {priority for priority, in session.query(Priority.priority)}
+    sections = {section for section, in session.query(Section.section)}
+    components = {c: get_mapped_component(c, session) for c in {o['component'] for o in overrides}}
+
     all_valid = True
     for o in overrides:
         o['valid'] = True
-        if session.query(Priority).filter_by(priority=o['priority']).first() is None:
+        if o['priority'] not in priorities:
             o['valid'] = False
-        if session.query(Section).filter_by(section=o['section']).first() is None:
+        if o['section'] not in sections:
             o['valid'] = False
-        if get_mapped_component(o['component'], session) is None:
+        if components[o['component']] is None:
             o['valid'] = False
         if o['type'] not in ('dsc', 'deb', 'udeb'):
             raise Exception('Unknown override type {0}'.format(o['type']))
@@ -82,18 +91,18 @@ def prod_maintainer(notes, upload: PolicyQueueUpload, session, trainee=False):
 
     # Here we prepare an editor and get them ready to prod...
     prod_message = "\n\n=====\n\n".join([note.comment for note in notes])
+    prompt = "[P]rod, Edit, Abandon, Quit ?"
+    default = re_default_answer.search(prompt).group(1)
     answer = 'E'
     while answer == 'E':
         prod_message = utils.call_editor(prod_message)
         print("Prod message:")
         print(utils.prefix_multi_line_string(prod_message, "  ", include_blank_lines=True))
-        prompt = "[P]rod, Edit, Abandon, Quit ?"
         answer = "XXX"
         while prompt.find(answer) == -1:
             answer = utils.input_or_exit(prompt)
-            m = re_default_answer.search(prompt)
             if answer == "":
-                answer = m.group(1)
+                answer = default
             answer = answer[:1].upper()
     if answer == 'A':
         return
@@ -154,12 +163,12 @@ def edit_note(note, upload, session, trainee=False):
             prompt = "Done, Edit, [A]bandon, Quit ?"
         else:
             prompt = "[D]one, Edit, Abandon, Quit ?"
+        default = re_default_answer.search(prompt).group(1)
         answer = "XXX"
         while prompt.find(answer) == -1:
             answer = utils.input_or_exit(prompt)
-            m = re_default_answer.search(prompt)
             if answer == "":
-                answer = m.group(1)
+                answer = default
             answer = answer[:1].upper()
     if answer == 'A':
         return
@@ -179,11 +188,38 @@ def edit_note(note, upload, session, trainee=False):
 ###############################################################################
 
 
+def get_suite_version_by_sources(sources: Iterable[str], session) -> dict[str, list[tuple[str, str]]]:
+    '''
+    returns a dict mapping each source package to a list of tuples
+    (suite_name, version); all sources are looked up with a single query
+    '''
+    q = session.query(DBSource.source, Suite.suite_name, DBSource.version). \
+        join(Suite.sources).filter(DBSource.source.in_(list(sources)))
+    result: dict[str, list[tuple[str, str]]] = defaultdict(list)
+    for source, suite_name, version in q:
+        result[source].append((suite_name, version))
+    return result
+
+
 def get_suite_version_by_source(source: str, session) -> list[tuple[str, str]]:
     'returns a list of tuples (suite_name, version) for source package'
-    q = session.query(Suite.suite_name, DBSource.version). \
-        join(Suite.sources).filter_by(source=source)
-    return q.all()
+    return get_suite_version_by_sources([source], session).get(source, [])
+
+
+def get_suite_version_by_packages(packages: Iterable[str], arch_string: str, session) -> dict[str, list[tuple[str, str]]]:
+    '''
+    returns a dict mapping each binary package to a list of tuples
+    (suite_name, version) for arch_string; all packages are looked up
+    with a single query
+    '''
+    q = session.query(DBBinary.package, Suite.suite_name, DBBinary.version). \
+        join(Suite.binaries).filter(DBBinary.package.in_(list(packages))). \
+        join(DBBinary.architecture). \
+        filter(Architecture.arch_string.in_([arch_string, 'all']))
+    result: dict[str, list[tuple[str, str]]] = defaultdict(list)
+    for package, suite_name, version in q:
+        result[package].append((suite_name, version))
+    return result
 
 
 def get_suite_version_by_package(package: str, arch_string: str, session) -> list[tuple[str, str]]:
@@ -191,7 +227,4 @@ def get_suite_version_by_package(package: str, arch_string: str, session) -> lis
     returns a list of tuples (suite_name, version) for binary package and
     arch_string
     '''
-    return session.query(Suite.suite_name, DBBinary.version). \
-        join(Suite.binaries).filter_by(package=package). \
-        join(DBBinary.architecture). \
-        filter(Architecture.arch_string.in_([arch_string, 'all'])).all()
+    return get_suite_version_by_packages([package], arch_string, session).get(package, [])
@@ -169,7 +169,8 @@ class ReverseDependencyChecker:
         for source, build_dep in query:
             if build_dep is not None:
                 # Remove [arch] information since we want to see breakage on all arches
-                build_dep = re_build_dep_arch.sub("", build_dep)
+                if '[' in build_dep:
+                    build_dep = re_build_dep_arch.sub("", build_dep)
                 try:
                     parsed_dep = []
                     for dep in apt_pkg.parse_src_depends(build_dep):
@@ -377,7 +378,7 @@ def remove(session, reason: str, suites: list, removals: list,
     for package in sorted(d):
         versions = sorted(d[package], key=functools.cmp_to_key(apt_pkg.version_compare))
         for version in versions:
-            d[package][version].sort(key=utils.ArchKey)
+            d[package][version].sort(key=utils.arch_sort_key)
             summary += "%10s | %10s | %s\n" % (package, version, ", ".join(d[package][version]))
             if apt_pkg.version_compare(version, newest_source) > 0:
                 newest_source = version
@@ -499,13 +500,14 @@ def remove(session, reason: str, suites: list, removals: list,
             summarymail += "----------------------------------------------\n"
             Subst_close_rm["__SUMMARY__"] = summarymail
 
-            for bug in done_bugs:
-                Subst_close_rm["__BUG_NUMBER__"] = bug
-                if close_related_bugs:
-                    mail_message = utils.TemplateSubst(Subst_close_rm, cnf["Dir::Templates"] + "/rm.bug-close-with-related")
-                else:
-                    mail_message = utils.TemplateSubst(Subst_close_rm, cnf["Dir::Templates"] + "/rm.bug-close")
-                utils.send_mail(mail_message, whitelists=whitelists)
+            with utils.sendmail_channel() as channel:
+                for bug in done_bugs:
+                    Subst_close_rm["__BUG_NUMBER__"] = bug
+                    if close_related_bugs:
+                        mail_message = utils.TemplateSubst(Subst_close_rm, cnf["Dir::Templates"] + "/rm.bug-close-with-related")
+                    else:
+                        mail_message = utils.TemplateSubst(Subst_close_rm, cnf["Dir::Templates"] + "/rm.bug-close")
+                    utils.send_mail(mail_message, whitelists=whitelists, channel=channel)
 
         # close associated bug reports
         if close_related_bugs:
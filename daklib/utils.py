@@ -26,30 +26,33 @@ import os
 import pwd
 import grp
 import shutil
+import smtplib
+import stat
 import sqlalchemy.sql as sql
 import sys
 import tempfile
 import apt_inst
 import apt_pkg
 import re
+import shlex
 import email.policy
 import subprocess
 import errno
 import functools
+import json
 from collections.abc import Iterable, Mapping, Sequence
 from typing import Literal, NoReturn, Optional, TYPE_CHECKING, Union
 
 import daklib.config as config
 import daklib.mail
-from daklib.dbconn import Architecture, DBConn, get_architecture, get_component, get_suite, \
+from daklib.dbconn import Architecture, DBConn, get_suite, get_suites, \
                    get_active_keyring_paths, \
                    get_suite_architectures, get_or_set_metadatakey, \
                    Component, Override, OverrideType
 from .dak_exceptions import *
 from .gpg import SignedFile
 from .textutils import fix_maintainer
-from .regexes import re_single_line_field, \
-                    re_multi_line_field, re_srchasver, \
+from .regexes import re_single_line_field, re_srchasver, \
                     re_re_mark, re_whitespace_comment, re_issource, \
                     re_build_dep_arch, re_parse_maintainer
 
@@ -64,10 +67,6 @@ if TYPE_CHECKING:
 
 ################################################################################
 
-key_uid_email_cache: dict[str, list[str]] = {}  #: Cache for email addresses from gpg key uids
-
-################################################################################
-
 
 def input_or_exit(prompt: Optional[str] = None) -> str:
     try:
@@ -85,8 +84,9 @@ def extract_component_from_section(section: str) -> tuple[str, str]:
 
     :return: tuple (section, component)
     """
-    if section.find('/') != -1:
-        return section, section.split('/', 1)[0]
+    component, sep, _ = section.partition('/')
+    if sep:
+        return section, component
     return section, "main"
 
 ################################################################################
@@ -102,50 +102,49 @@ def parse_deb822(armored_contents: bytes, signing_rules: Literal[-1, 0, 1] = 0,
     contents = signed_file.contents.decode('utf-8')
 
     error = ""
-    changes = {}
+    # Field values are collected as lists of pieces and only joined once
+    # all lines have been seen.
+    buffers: dict[str, list[str]] = {}
 
-    # Split the lines in the input, keeping the linebreaks.
-    lines = contents.splitlines(True)
+    lines = contents.splitlines()
 
     if len(lines) == 0:
         raise ParseChangesError("[Empty changes file]")
 
-    # Reindex by line number so we can easily verify the format of
-    # .dsc files...
-    index = 0
-    indexed_lines = {}
-    for line in lines:
-        index += 1
-        indexed_lines[index] = line[:-1]
-
-    num_of_lines = len(indexed_lines)
-    index = 0
+    num_of_lines = len(lines)
     first = -1
-    while index < num_of_lines:
-        index += 1
-        line = indexed_lines[index]
-        if line == "" and signing_rules == 1:
-            if index != num_of_lines:
-                raise InvalidDscError(index)
-            break
-        if slf := re_single_line_field.match(line):
-            field = slf.groups()[0].lower()
-            changes[field] = slf.groups()[1]
-            first = 1
-            continue
-        if line == " .":
-            changes[field] += '\n'
+    match_single_line_field = re_single_line_field.match
+    # Keep track of line numbers so we can easily verify the format of
+    # .dsc files...
+    for index, line in enumerate(lines, 1):
+        if not line:
+            if signing_rules == 1:
+                if index != num_of_lines:
+                    raise InvalidDscError(index)
+                break
             continue
-        if mlf := re_multi_line_field.match(line):
+        # Continuation lines make up most of a typical file and only
+        # need their leading whitespace checked, no regex.
+        if line[0].isspace():
             if first == -1:
                 raise ParseChangesError("'%s'\n [Multi-line field continuing on from nothing?]" % (line))
-            if first == 1 and changes[field] != "":
-                changes[field] += '\n'
+            if line == " .":
+                buffer.append('\n')
+                continue
+            if first == 1 and (len(buffer) > 1 or buffer[0] != ""):
+                buffer.append('\n')
             first = 0
-            changes[field] += mlf.groups()[0] + '\n'
+            buffer.append(line[1:] + '\n')
+            continue
+        if slf := match_single_line_field(line):
+            field, value = slf.groups()
+            # Continuation lines are added to the most recent field
+            buffer = buffers[field.lower()] = [value]
+            first = 1
             continue
         error += line
 
+    changes = {field: "".join(buffer) for field, buffer in buffers.items()}
     changes["filecontents"] = armored_contents.decode()
 
     if "source" in changes:
@@ -163,6 +162,13 @@ def parse_deb822(armored_contents: bytes, signing_rules: Literal[-1, 0, 1] = 0,
 ################################################################################
 
 
+# Mandatory fields of a .changes file, lower-cased as returned by
+# parse_deb822, mapped to their usual spelling
+_changes_must_fields = {keyword.lower(): keyword for keyword in (
+    'Format', 'Date', 'Source', 'Architecture', 'Version',
+    'Distribution', 'Maintainer', 'Changes', 'Files')}
+
+
 def parse_changes(filename: str, signing_rules: Literal[-1, 0, 1] = 0, dsc_file: bool = False, keyrings=None) -> dict[str, str]:
     """
     Parses a changes or source control (.dsc) file and returns a dictionary
@@ -193,16 +199,9 @@ def parse_changes(filename: str, signing_rules: Literal[-1, 0, 1] = 0, dsc_file:
 
     if not dsc_file:
         # Finally ensure that everything needed for .changes is there
-        must_keywords = ('Format', 'Date', 'Source', 'Architecture', 'Version',
-                         'Distribution', 'Maintainer', 'Changes', 'Files')
-
-        missingfields = []
-        for keyword in must_keywords:
-            if keyword.lower() not in changes:
-                missingfields.append(keyword)
-
-                if len(missingfields):
-                    raise ParseChangesError("Missing mandatory field(s) in changes file (policy 5.5): %s" % (missingfields))
+        if _changes_must_fields.keys() - changes.keys():
+            missingfields = [keyword for field, keyword in _changes_must_fields.items() if field not in changes]
+            raise ParseChangesError("Missing mandatory field(s) in changes file (policy 5.5): %s" % (missingfields))
 
     return changes
 
@@ -210,6 +209,24 @@ def parse_changes(filename: str, signing_rules: Literal[-1, 0, 1] = 0, dsc_file:
 ################################################################################
 
 
+#: Lookup table used by :func:`check_dsc_files` to classify source files by
+#: their extension; the first matching entry wins.  The first key of each
+#: entry names its group in :data:`_re_ftype`.
+_ftype_lookup = (
+    (r'orig\.tar\.(?:gz|bz2|xz)\.asc', ('orig_tar_sig',)),
+    (r'orig\.tar\.gz',               ('orig_tar_gz', 'orig_tar')),
+    (r'diff\.gz',                    ('debian_diff',)),
+    (r'tar\.gz',                     ('native_tar_gz', 'native_tar')),
+    (r'debian\.tar\.(?:gz|bz2|xz)',  ('debian_tar',)),
+    (r'orig\.tar\.(?:gz|bz2|xz)',    ('orig_tar',)),
+    (r'tar\.(?:gz|bz2|xz)',          ('native_tar',)),
+    (r'orig-.+\.tar\.(?:gz|bz2|xz)\.asc', ('more_orig_tar_sig',)),
+    (r'orig-.+\.tar\.(?:gz|bz2|xz)', ('more_orig_tar',)),
+)
+_ftype_keys = {keys[0]: keys for regex, keys in _ftype_lookup}
+_re_ftype = re.compile('|'.join(r'(?P<{0}>{1}\Z)'.format(keys[0], regex) for regex, keys in _ftype_lookup))
+
+
 def check_dsc_files(dsc_filename: str, dsc: Mapping[str, str], dsc_files: Mapping[str, Mapping[str, str]]) -> list[str]:
     """
     Verify that the files listed in the Files field of the .dsc are
@@ -226,18 +243,6 @@ def check_dsc_files(dsc_filename: str, dsc: Mapping[str, str], dsc_files: Mappin
     # announced
     has: defaultdict[str, int] = defaultdict(lambda: 0)
 
-    ftype_lookup = (
-        (r'orig\.tar\.(gz|bz2|xz)\.asc', ('orig_tar_sig',)),
-        (r'orig\.tar\.gz',             ('orig_tar_gz', 'orig_tar')),
-        (r'diff\.gz',                  ('debian_diff',)),
-        (r'tar\.gz',                   ('native_tar_gz', 'native_tar')),
-        (r'debian\.tar\.(gz|bz2|xz)',  ('debian_tar',)),
-        (r'orig\.tar\.(gz|bz2|xz)',    ('orig_tar',)),
-        (r'tar\.(gz|bz2|xz)',          ('native_tar',)),
-        (r'orig-.+\.tar\.(gz|bz2|xz)\.asc', ('more_orig_tar_sig',)),
-        (r'orig-.+\.tar\.(gz|bz2|xz)', ('more_orig_tar',)),
-    )
-
     for f in dsc_files:
         m = re_issource.match(f)
         if not m:
@@ -246,19 +251,16 @@ def check_dsc_files(dsc_filename: str, dsc: Mapping[str, str], dsc_files: Mappin
             continue
 
         # Populate 'has' dictionary by resolving keys in lookup table
-        matched = False
-        for regex, keys in ftype_lookup:
-            if re.match(regex, m.group(3)):
-                matched = True
-                for key in keys:
-                    has[key] += 1
-                break
+        ftype = _re_ftype.match(m.group(3))
 
         # File does not match anything in lookup table; reject
-        if not matched:
+        if not ftype:
             rejmsg.append("%s: unexpected source file '%s'" % (dsc_filename, f))
             break
 
+        for key in _ftype_keys[ftype.lastgroup]:
+            has[key] += 1
+
     # Check for multiple files
     for file_type in ('orig_tar', 'orig_tar_sig', 'native_tar', 'debian_tar', 'debian_diff'):
         if has[file_type] > 1:
@@ -296,9 +298,9 @@ def build_file_list(changes: Mapping[str, str], is_a_dsc: bool = False, field="f
     includes_section = (not is_a_dsc) and field == "files"
 
     # Parse each entry/line:
-    for i in changes[field].split('\n'):
+    for i in changes[field].splitlines():
         if not i:
-            break
+            continue
         s = i.split()
         section = priority = ""
         try:
@@ -316,16 +318,84 @@ def build_file_list(changes: Mapping[str, str], is_a_dsc: bool = False, field="f
 
         (section, component) = extract_component_from_section(section)
 
-        files[name] = dict(size=size, section=section,
-                           priority=priority, component=component)
-        files[name][hashname] = md5
+        files[name] = {"size": size, "section": section, "priority": priority,
+                       "component": component, hashname: md5}
 
     return files
 
 ################################################################################
 
 
-def send_mail(message: str, whitelists: Optional[list[str]] = None) -> None:
+_mail_whitelist_cache: dict[tuple[str, int], list[re.Pattern]] = {}
+
+
+def _load_mail_whitelist(path: str) -> list[re.Pattern]:
+    """read a mail whitelist, caching the compiled patterns by mtime
+
+    The entries of a whitelist are combined into a single alternation
+    unless one of them uses groups (which could be referred to by
+    number and would be renumbered by combining them) or sets global
+    flags (which would then apply to every entry).  If the combined
+    pattern does not compile, the entries are also kept separate.
+    """
+    key = (path, os.stat(path).st_mtime_ns)
+    whitelist = _mail_whitelist_cache.get(key)
+    if whitelist is not None:
+        return whitelist
+
+    patterns = []
+    with open(path, 'r') as whitelist_in:
+        for line in whitelist_in:
+            if not re_whitespace_comment.match(line):
+                if re_re_mark.match(line):
+                    patterns.append(re.compile(re_re_mark.sub("", line.strip(), 1)))
+                else:
+                    patterns.append(re.compile(re.escape(line.strip())))
+
+    whitelist = patterns
+    if len(patterns) > 1 and all(pattern.groups == 0 and pattern.flags == re.UNICODE for pattern in patterns):
+        try:
+            whitelist = [re.compile('|'.join('(?:{0})'.format(pattern.pattern) for pattern in patterns))]
+        except re.error:
+            # keep the separately compiled patterns
+            pass
+
+    _mail_whitelist_cache[key] = whitelist
+    return whitelist
+
+
+def sendmail_channel():
+    """connection to the MTA to pass to :func:`send_mail` for several mails
+
+    Unless mail is disabled, this connects to Dinstall::SendmailChannel
+    (see :func:`daklib.mail.get_sendmail_channel`). Otherwise the
+    context manager yields :const:`None` and :func:`send_mail` runs
+    Dinstall::SendmailCommand for every mail as usual.
+    """
+    if "Dinstall::Options::No-Mail" in Cnf and Cnf["Dinstall::Options::No-Mail"]:
+        return daklib.mail.get_sendmail_channel(None)
+    return daklib.mail.get_sendmail_channel(Cnf.get("Dinstall::SendmailChannel"))
+
+
+def _sendmail_envelope_sender() -> Optional[str]:
+    """envelope sender to use when sending mail over a channel
+
+    This is Dinstall::SendmailEnvelopeSender if set, otherwise the
+    argument of the ``-f`` option in Dinstall::SendmailCommand, so the
+    bounce address does not depend on how the mail is sent.
+    """
+    if sender := Cnf.get("Dinstall::SendmailEnvelopeSender"):
+        return sender
+    args = Cnf.get("Dinstall::SendmailCommand", "").split()
+    for i, arg in enumerate(args):
+        if arg == "-f" and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith("-f") and len(arg) > 2:
+            return arg[2:]
+    return None
+
+
+def send_mail(message: str, whitelists: Optional[list[str]] = None, channel=None) -> None:
     """sendmail wrapper, takes a message string
 
     :param whitelists: path to whitelists. :const:`None` or an empty list whitelists
@@ -333,6 +403,8 @@ def send_mail(message: str, whitelists: Optional[list[str]] = None) -> None:
                        included in any of the lists.
                        In addition a global whitelist can be specified in
                        Dinstall::MailWhiteList.
+    :param channel: connection to the MTA as returned by :func:`sendmail_channel`.
+                    If :const:`None`, Dinstall::SendmailCommand is run instead.
     """
 
     msg = daklib.mail.parse_mail(message)
@@ -350,18 +422,14 @@ def send_mail(message: str, whitelists: Optional[list[str]] = None) -> None:
 
     if whitelists is None or None in whitelists:
         whitelists = []
+    else:
+        whitelists = list(whitelists)
     if Cnf.get('Dinstall::MailWhiteList', ''):
         whitelists.append(Cnf['Dinstall::MailWhiteList'])
     if len(whitelists) != 0:
         whitelist = []
         for path in whitelists:
-            with open(path, 'r') as whitelist_in:
-                for line in whitelist_in:
-                    if not re_whitespace_comment.match(line):
-                        if re_re_mark.match(line):
-                            whitelist.append(re.compile(re_re_mark.sub("", line.strip(), 1)))
-                        else:
-                            whitelist.append(re.compile(re.escape(line.strip())))
+            whitelist.extend(_load_mail_whitelist(path))
 
         # Fields to check.
         fields = ["To", "Bcc", "Cc"]
@@ -400,6 +468,11 @@ def send_mail(message: str, whitelists: Optional[list[str]] = None) -> None:
                 # return, as we removed all recipients.
                 call_sendmail = False
 
+    maildir = Cnf.get('Dir::Mail')
+    if not call_sendmail and not maildir:
+        # Nobody will see the message, so neither sign nor serialize it
+        return
+
     # sign mail
     if mailkey := Cnf.get('Dinstall::Mail-Signature-Key', ''):
         kwargs = {
@@ -413,16 +486,21 @@ def send_mail(message: str, whitelists: Optional[list[str]] = None) -> None:
 
     msg_bytes = msg.as_bytes(policy=email.policy.default)
 
-    maildir = Cnf.get('Dir::Mail')
     if maildir:
         path = os.path.join(maildir, datetime.datetime.now().isoformat())
-        path = find_next_free(path)
-        with open(path, 'wb') as fh:
+        fd, path = open_next_free(path)
+        with os.fdopen(fd, 'wb') as fh:
             fh.write(msg_bytes)
 
     # Invoke sendmail
     if not call_sendmail:
         return
+    if channel is not None:
+        try:
+            channel.send_message(msg, from_addr=_sendmail_envelope_sender())
+        except smtplib.SMTPException as e:
+            raise SendmailFailedError(str(e))
+        return
     try:
         subprocess.run(Cnf["Dinstall::SendmailCommand"].split(),
                        input=msg_bytes,
@@ -436,10 +514,8 @@ def send_mail(message: str, whitelists: Optional[list[str]] = None) -> None:
 
 def poolify(source: str) -> str:
     """convert `source` name into directory path used in pool structure"""
-    if source[:3] == "lib":
-        return source[:4] + '/' + source + '/'
-    else:
-        return source[:1] + '/' + source + '/'
+    prefix = source[:4] if source.startswith("lib") else source[:1]
+    return f"{prefix}/{source}/"
 
 ################################################################################
 
@@ -463,6 +539,27 @@ def move(src: str, dest: str, overwrite: bool = False, perms: int = 0o664) -> No
         else:
             if not os.access(dest, os.W_OK):
                 fubar("Can't move %s to %s - can't write to existing file." % (src, dest))
+    # Within a filesystem a rename is enough; copy2 would follow a
+    # symlink, so keep copying those.  A rename also keeps the owner and
+    # group of the source, so only use it for our own files that already
+    # have the group a copy would get (that of a setgid destination
+    # directory, or our own).
+    src_stat = os.lstat(src)
+    dest_dir_stat = os.stat(os.path.dirname(dest) or '.')
+    if dest_dir_stat.st_mode & stat.S_ISGID:
+        new_gid = dest_dir_stat.st_gid
+    else:
+        new_gid = os.getegid()
+    if not stat.S_ISLNK(src_stat.st_mode) and src_stat.st_uid == os.geteuid() \
+            and src_stat.st_gid == new_gid:
+        try:
+            os.rename(src, dest)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        else:
+            os.chmod(dest, perms)
+            return
     shutil.copy2(src, dest)
     os.chmod(dest, perms)
     os.unlink(src)
@@ -475,9 +572,17 @@ def TemplateSubst(subst_map: Mapping[str, str], filename: str) -> str:
     """ Perform a substition of template """
     with open(filename) as templatefile:
         template = templatefile.read()
-    for k, v in subst_map.items():
-        template = template.replace(k, str(v))
-    return template
+    keys = frozenset(k for k in subst_map if k)
+    if not keys:
+        return template
+    return _template_subst_re(keys).sub(lambda m: str(subst_map[m.group(0)]), template)
+
+
+@functools.lru_cache(maxsize=None)
+def _template_subst_re(keys: frozenset[str]) -> re.Pattern:
+    # Longest keys first so a key that is a prefix of another one does
+    # not shadow it.
+    return re.compile('|'.join(re.escape(k) for k in sorted(keys, key=lambda k: (-len(k), k))))
 
 ################################################################################
 
@@ -534,14 +639,58 @@ def find_next_free(dest: str, too_many: int = 100) -> str:
         raise NoFreeFilenameError
     return dest
 
+
+def _find_next_free_in(existing: set[str], dest: str, too_many: int = 100) -> str:
+    """like :func:`find_next_free`, but for many files in one directory
+
+    :param existing: names of the entries in the directory of `dest`; the
+                     name picked is added to it
+    """
+    directory, name = os.path.split(dest)
+    candidate = name
+    extra = 0
+    while candidate in existing and extra < too_many:
+        candidate = name + '.' + repr(extra)
+        extra += 1
+    if extra >= too_many:
+        raise NoFreeFilenameError
+    existing.add(candidate)
+    return os.path.join(directory, candidate)
+
+
+def _listdir_set(directory: str) -> set[str]:
+    try:
+        return set(os.listdir(directory))
+    except FileNotFoundError:
+        return set()
+
+
+def open_next_free(dest: str, too_many: int = 100, mode: int = 0o666) -> tuple[int, str]:
+    """create and open a new file named `dest` or `dest.N`
+
+    Like :func:`find_next_free`, but the file is created with
+    :const:`os.O_EXCL` so the name cannot be taken by someone else
+    between finding and opening it.
+
+    :return: tuple (fd, path) of the file opened for writing
+    """
+    path = dest
+    # try the same too_many names as find_next_free
+    for extra in range(too_many):
+        try:
+            return os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, mode), path
+        except FileExistsError:
+            path = dest + '.' + repr(extra)
+    raise NoFreeFilenameError
+
 ################################################################################
 
 
 def result_join(original: Iterable[Optional[str]], sep: str = '\t') -> str:
-    return sep.join(
+    return sep.join([
         x if x is not None else ""
         for x in original
-    )
+    ])
 
 
 ################################################################################
@@ -549,11 +698,11 @@ def result_join(original: Iterable[Optional[str]], sep: str = '\t') -> str:
 
 def prefix_multi_line_string(lines: str, prefix: str, include_blank_lines: bool = False) -> str:
     """prepend `prefix` to each line in `lines`"""
-    return "\n".join(
+    return "\n".join([
         prefix + cleaned_line
         for line in lines.split("\n")
         if (cleaned_line := line.strip()) or include_blank_lines
-    )
+    ])
 
 ################################################################################
 
@@ -569,11 +718,10 @@ def join_with_commas_and(list: Sequence[str]) -> str:
 
 
 def pp_deps(deps: Iterable[tuple[str, str, str]]) -> str:
-    pp_deps = (
+    return " |".join([
         f"{pkg} ({constraint} {version})" if constraint else pkg
         for pkg, constraint, version in deps
-    )
-    return " |".join(pp_deps)
+    ])
 
 ################################################################################
 
@@ -593,8 +741,10 @@ def parse_args(Options) -> tuple[str, str, str, bool]:
     # Process suite
     if Options["Suite"]:
         suite_ids_list = []
-        for suitename in split_args(Options["Suite"]):
-            suite = get_suite(suitename, session=session)
+        suitenames = split_args(Options["Suite"])
+        suites = get_suites(suitenames, session=session)
+        for suitename in suitenames:
+            suite = suites.get(suitename)
             if not suite or suite.suite_id is None:
                 warn("suite '%s' not recognised." % (suite and suite.suite_name or suitename))
             else:
@@ -609,8 +759,13 @@ def parse_args(Options) -> tuple[str, str, str, bool]:
     # Process component
     if Options["Component"]:
         component_ids_list = []
-        for componentname in split_args(Options["Component"]):
-            component = get_component(componentname, session=session)
+        componentnames = split_args(Options["Component"])
+        components = {
+            c.component_name: c
+            for c in session.query(Component).filter(Component.component_name.in_([n.lower() for n in componentnames]))
+        }
+        for componentname in componentnames:
+            component = components.get(componentname.lower())
             if component is None:
                 warn("component '%s' not recognised." % (componentname))
             else:
@@ -627,11 +782,16 @@ def parse_args(Options) -> tuple[str, str, str, bool]:
     check_source = False
     if Options["Architecture"]:
         arch_ids_list = []
-        for archname in split_args(Options["Architecture"]):
+        archnames = split_args(Options["Architecture"])
+        archs = {
+            a.arch_string: a
+            for a in session.query(Architecture).filter(Architecture.arch_string.in_(archnames))
+        }
+        for archname in archnames:
             if archname == "source":
                 check_source = True
             else:
-                arch = get_architecture(archname, session=session)
+                arch = archs.get(archname)
                 if arch is None:
                     warn("architecture '%s' not recognised." % (archname))
                 else:
@@ -649,12 +809,23 @@ def parse_args(Options) -> tuple[str, str, str, bool]:
 ################################################################################
 
 
+def arch_sort_key(arch: str) -> tuple[bool, str]:
+    """
+    Key function for use in sorting lists of architectures.
+
+    Sorts normally except that 'source' dominates all others.
+    """
+    return (arch != 'source', arch)
+
+
 @functools.total_ordering
 class ArchKey:
     """
     Key object for use in sorting lists of architectures.
 
     Sorts normally except that 'source' dominates all others.
+
+    Kept for compatibility; new code should use :func:`arch_sort_key`.
     """
 
     __slots__ = ['arch', 'issource']
@@ -707,20 +878,16 @@ def gpg_keyring_args(keyrings: Optional[Iterable[str]] = None) -> list[str]:
 ################################################################################
 
 
+# uid (field 10) of "uid" and "pub" records in a gpg colon listing, skipping
+# those that are invalid, disabled or revoked
+_re_gpg_uid = re.compile(rb'^(?:uid|pub):(?![idr](?::|$))[^:\n]*:(?:[^:\n]*:){7}([^:\n]*)', re.MULTILINE)
+
+
 def _gpg_get_addresses_from_listing(output: bytes) -> list[str]:
     addresses: list[str] = []
 
-    for line in output.split(b'\n'):
-        parts = line.split(b':')
-        if parts[0] not in (b"uid", b"pub"):
-            continue
-        if parts[1] in (b"i", b"d", b"r"):
-            # Skip uid that is invalid, disabled or revoked
-            continue
-        try:
-            uid_bytes = parts[9]
-        except IndexError:
-            continue
+    for m in _re_gpg_uid.finditer(output):
+        uid_bytes = m.group(1)
         try:
             uid = uid_bytes.decode(encoding='utf-8')
         except UnicodeDecodeError:
@@ -741,25 +908,136 @@ def _gpg_get_addresses_from_listing(output: bytes) -> list[str]:
     return addresses
 
 
-def gpg_get_key_addresses(fingerprint: str) -> list[str]:
-    """retreive email addresses from gpg key uids for a given fingerprint"""
-    addresses = key_uid_email_cache.get(fingerprint)
-    if addresses is not None:
-        return addresses
+def _gpg_get_addresses_by_fingerprint(output: bytes) -> dict[str, list[str]]:
+    """split a gpg colon listing of several keys into per-key addresses
+
+    :return: mapping of every (sub)key fingerprint of a key to the
+             addresses of that key
+    """
+    result: dict[str, list[str]] = {}
+
+    blocks = output.split(b'\npub:')
+    for n, block in enumerate(blocks):
+        if n > 0:
+            block = b'pub:' + block
+        elif not block.startswith(b'pub:'):
+            continue
+        addresses = _gpg_get_addresses_from_listing(block)
+        for line in block.split(b'\n'):
+            parts = line.split(b':')
+            if parts[0] == b'fpr' and len(parts) > 9:
+                result[parts[9].decode('ascii')] = addresses
+
+    return result
+
 
+def _keyring_state(keyrings: Iterable[str]) -> Optional[list[list]]:
+    """state of the keyrings the key address cache is valid for
+
+    Returns :const:`None` if a keyring cannot be accessed; the cache is
+    not used then.
+    """
     try:
-        cmd = ["gpg", "--no-default-keyring"]
-        cmd.extend(gpg_keyring_args())
-        cmd.extend(["--with-colons", "--list-keys", "--", fingerprint])
-        output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
-    except subprocess.CalledProcessError:
-        addresses = []
-    else:
-        addresses = _gpg_get_addresses_from_listing(output)
+        return [[path, os.stat(path).st_mtime_ns] for path in keyrings]
+    except OSError:
+        return None
 
-    key_uid_email_cache[fingerprint] = addresses
+
+def _load_key_address_cache(path: str, state: list[list]) -> dict[str, list[str]]:
+    try:
+        with open(path) as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    # Any change to the keyrings invalidates the whole cache
+    if data.get('keyrings') != state:
+        return {}
+    addresses = data.get('addresses')
+    if not isinstance(addresses, dict):
+        return {}
     return addresses
 
+
+def _store_key_address_cache(path: str, state: list[list], addresses: dict[str, list[str]]) -> None:
+    tmp = "{0}.{1}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp, 'w') as fh:
+            json.dump({'keyrings': state, 'addresses': addresses}, fh)
+        os.rename(tmp, path)
+    except OSError:
+        # The cache is only an optimisation; go on without it
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+def gpg_get_key_addresses_many(fingerprints: Iterable[str]) -> dict[str, list[str]]:
+    """retreive email addresses from gpg key uids for several fingerprints
+
+    All fingerprints are looked up with a single gpg invocation.  If
+    Dinstall::KeyAddressCache is set, results are also kept in that file
+    for as long as the active keyrings do not change.
+    """
+    result: dict[str, list[str]] = {}
+    missing = list(dict.fromkeys(fingerprints))
+
+    if not missing:
+        return result
+
+    keyrings = get_active_keyring_paths()
+    cache_path = Cnf.get('Dinstall::KeyAddressCache')
+    if cache_path:
+        state = _keyring_state(keyrings)
+        if state is None:
+            cache_path = None
+    if cache_path:
+        cached = _load_key_address_cache(cache_path, state)
+        for fingerprint in missing:
+            if fingerprint in cached:
+                result[fingerprint] = cached[fingerprint]
+        missing = [fingerprint for fingerprint in missing if fingerprint not in cached]
+
+    if missing:
+        cmd = ["gpg", "--no-default-keyring"]
+        cmd.extend(gpg_keyring_args(keyrings))
+        cmd.extend(["--with-colons", "--list-keys", "--"])
+        cmd.extend(missing)
+        # gpg exits non-zero if any of the keys is unknown, but still lists
+        # the others
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        if len(missing) == 1:
+            if proc.returncode == 0:
+                listed = {missing[0]: _gpg_get_addresses_from_listing(proc.stdout)}
+            else:
+                listed = {}
+        else:
+            listed = _gpg_get_addresses_by_fingerprint(proc.stdout)
+
+        for fingerprint in missing:
+            result[fingerprint] = listed.get(fingerprint, [])
+
+        # Only cache what gpg actually listed (nothing if it produced no
+        # output): a key missing from the output may just be the result
+        # of a failed gpg run
+        if cache_path and listed:
+            cached.update(listed)
+            _store_key_address_cache(cache_path, state, cached)
+
+    return result
+
+
+@functools.lru_cache(maxsize=8192)
+def gpg_get_key_addresses(fingerprint: str) -> tuple[str, ...]:
+    """retreive email addresses from gpg key uids for a given fingerprint
+
+    Results are cached for the most recently used fingerprints.
+    """
+    return tuple(gpg_get_key_addresses_many([fingerprint])[fingerprint])
+
 ################################################################################
 
 
@@ -878,7 +1156,10 @@ def get_changes_files(from_dir: str) -> list[str]:
     try:
         # Much of the rest of p-u/p-a depends on being in the right place
         os.chdir(from_dir)
-        changes_files = [x for x in os.listdir(from_dir) if x.endswith('.changes')]
+        # is_file() can mostly use the directory entry's type, no stat
+        with os.scandir(from_dir) as it:
+            changes_files = [entry.name for entry in it
+                             if entry.name.endswith('.changes') and entry.is_file()]
     except OSError as e:
         fubar("Failed to read list from directory %s (%s)" % (from_dir, e))
 
@@ -892,6 +1173,9 @@ Cnf = config.Config().Cnf
 ################################################################################
 
 
+_re_wnpp_bug = re.compile(r"\d+")
+
+
 def parse_wnpp_bug_file(file: str = "/srv/ftp-master.debian.org/scripts/masterfiles/wnpp_rm") -> dict[str, list[str]]:
     """
     Parses the wnpp bug list available at https://qa.debian.org/data/bts/wnpp_rm
@@ -904,24 +1188,17 @@ def parse_wnpp_bug_file(file: str = "/srv/ftp-master.debian.org/scripts/masterfi
 
     try:
         with open(file) as f:
-            lines = f.readlines()
+            lines = f.read().splitlines()
     except OSError:
         print("Warning:  Couldn't open %s; don't know about WNPP bugs, so won't close any." % file)
         lines = []
     wnpp = {}
 
     for line in lines:
-        splited_line = line.split(": ", 1)
-        if len(splited_line) > 1:
-            wnpp[splited_line[0]] = splited_line[1].split("|")
-
-    for source in wnpp:
-        bugs = []
-        for wnpp_bug in wnpp[source]:
-            bug_no = re.search(r"(\d)+", wnpp_bug).group()
-            if bug_no:
-                bugs.append(bug_no)
-        wnpp[source] = bugs
+        source, sep, wnpp_bugs = line.partition(": ")
+        if sep:
+            wnpp[source] = [bug_no.group() for wnpp_bug in wnpp_bugs.split("|")
+                            if (bug_no := _re_wnpp_bug.search(wnpp_bug))]
     return wnpp
 
 ################################################################################
@@ -929,7 +1206,11 @@ def parse_wnpp_bug_file(file: str = "/srv/ftp-master.debian.org/scripts/masterfi
 
 def deb_extract_control(path: str) -> bytes:
     """extract DEBIAN/control from a binary package"""
-    return apt_inst.DebFile(path).control.extractdata("control")
+    with open(path, 'rb') as fh:
+        if hasattr(os, 'posix_fadvise'):
+            # control.tar is near the start and read front to back
+            os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        return apt_inst.DebFile(fh).control.extractdata("control")
 
 ################################################################################
 
@@ -959,8 +1240,8 @@ def mail_addresses_for_upload(maintainer: str, changed_by: str, fingerprint: str
         pass
 
     # Compute the set of addresses of the recipients
-    addresses = set()  # Name + email
-    emails = set()     # Email only, used to avoid duplicates
+    encoded_addresses = []  # RFC 2047-encoded name + email
+    emails = set()          # Email only, used to avoid duplicates
     for recipient in recipients:
         if recipient.startswith('mail:'):  # Email hardcoded in config
             address = recipient[5:]
@@ -979,12 +1260,11 @@ def mail_addresses_for_upload(maintainer: str, changed_by: str, fingerprint: str
                 'Dinstall::UploadMailRecipients', recipient))
 
         if address is not None:
-            mail = fix_maintainer(address)[3]
+            _, rfc2047_address, _, mail = fix_maintainer(address)
             if mail not in emails:
-                addresses.add(address)
+                encoded_addresses.append(rfc2047_address)
                 emails.add(mail)
 
-    encoded_addresses = [fix_maintainer(e)[1] for e in addresses]
     return encoded_addresses
 
 ################################################################################
@@ -992,7 +1272,7 @@ def mail_addresses_for_upload(maintainer: str, changed_by: str, fingerprint: str
 
 def call_editor_for_file(path: str) -> None:
     editor = os.environ.get('VISUAL', os.environ.get('EDITOR', 'sensible-editor'))
-    subprocess.check_call([editor, path])
+    subprocess.check_call(shlex.split(editor) + [path])
 
 ################################################################################
 
@@ -1014,6 +1294,31 @@ def call_editor(text: str = "", suffix: str = ".txt") -> str:
 ################################################################################
 
 
+def _print_broken(field: str, broken: Iterable[tuple[str, Sequence[str]]], cruft: bool) -> None:
+    """print a check_reverse_depends report with a single write
+
+    :param field: name of the broken field
+    :param broken: pairs of source and its (non-empty) lines to report
+    :param cruft: format for cruft-report instead of dak rm
+    """
+    if cruft:
+        parts = ["  - broken {0}:".format(field)]
+        indent = '    '
+    else:
+        parts = ["# Broken {0}:".format(field)]
+        indent = ''
+    for source, lines in broken:
+        parts.append('%s%s: %s' % (indent, source, lines[0]))
+        pad = indent + ' ' * (len(source) + 2)
+        parts.extend(pad + line for line in lines[1:])
+    if not cruft:
+        parts.append('')
+    sys.stdout.write('\n'.join(parts) + '\n')
+
+
+_re_nonmain_component_suffix = re.compile('/(contrib|non-free-firmware|non-free)$')
+
+
 def check_reverse_depends(removals: Iterable[str], suite: str, arches: Optional[Iterable[Architecture]] = None, session=None, cruft: bool = False, quiet: bool = False, include_arch_all: bool = True) -> bool:
     dbsuite = get_suite(suite, session)
     overridesuite = dbsuite
@@ -1027,72 +1332,64 @@ def check_reverse_depends(removals: Iterable[str], suite: str, arches: Optional[
     else:
         all_arches = set(x.arch_string for x in get_suite_architectures(suite))
     all_arches -= set(["source", "all"])
-    removal_set = set(removals)
+    # removals is checked in the innermost loops, make sure it is a set
+    removals = frozenset(removals)
     metakey_d = get_or_set_metadatakey("Depends", session)
-    metakey_p = get_or_set_metadatakey("Provides", session)
     params = {
         'suite_id':     dbsuite.suite_id,
         'metakey_d_id': metakey_d.key_id,
-        'metakey_p_id': metakey_p.key_id,
     }
     if include_arch_all:
         rdep_architectures = all_arches | set(['all'])
     else:
         rdep_architectures = all_arches
-    for architecture in rdep_architectures:
+    # Most Depends fields are the same on all architectures, so only parse
+    # each distinct one once during this run
+    parse_depends = functools.lru_cache(maxsize=None)(apt_pkg.parse_depends)
+
+    arch_strings = dict(session.query(Architecture.arch_id, Architecture.arch_string)
+                        .filter(Architecture.arch_string.in_(rdep_architectures)))
+    params['arch_ids'] = tuple(arch_strings)
+    params['removals'] = tuple(removals)
+
+    # Packages to be removed cannot break, so they are not fetched
+    where = 'b.architecture IN :arch_ids'
+    if removals:
+        where += ' AND b.package NOT IN :removals'
+    statement = sql.text('''
+        SELECT b.architecture, b.package, s.source, c.name as component,
+            bmd.value AS depends
+            FROM binaries b
+            JOIN bin_associations ba ON b.id = ba.bin AND ba.suite = :suite_id
+            JOIN source s ON b.source = s.id
+            JOIN files_archive_map af ON b.file = af.file_id
+            JOIN component c ON af.component_id = c.id
+            LEFT JOIN binaries_metadata bmd ON bmd.bin_id = b.id AND bmd.key_id = :metakey_d_id
+            WHERE ''' + where)
+    query = session.query(sql.column('architecture'), sql.column('package'),
+                          sql.column('source'), sql.column('component'),
+                          sql.column('depends')). \
+        from_statement(statement).params(params)
+    rows_by_arch = defaultdict(list)
+    if arch_strings:
+        for arch_id, *row in query:
+            rows_by_arch[arch_strings[arch_id]].append(row)
+
+    for architecture, rows in rows_by_arch.items():
         deps = {}
         sources = {}
-        virtual_packages = {}
-        try:
-            params['arch_id'] = get_architecture(architecture, session).arch_id
-        except AttributeError:
-            continue
-
-        statement = sql.text('''
-            SELECT b.package, s.source, c.name as component,
-                (SELECT bmd.value FROM binaries_metadata bmd WHERE bmd.bin_id = b.id AND bmd.key_id = :metakey_d_id) AS depends,
-                (SELECT bmp.value FROM binaries_metadata bmp WHERE bmp.bin_id = b.id AND bmp.key_id = :metakey_p_id) AS provides
-                FROM binaries b
-                JOIN bin_associations ba ON b.id = ba.bin AND ba.suite = :suite_id
-                JOIN source s ON b.source = s.id
-                JOIN files_archive_map af ON b.file = af.file_id
-                JOIN component c ON af.component_id = c.id
-                WHERE b.architecture = :arch_id''')
-        query = session.query(sql.column('package'), sql.column('source'),
-                              sql.column('component'), sql.column('depends'),
-                              sql.column('provides')). \
-            from_statement(statement).params(params)
-        for package, source, component, depends, provides in query:
+        for package, source, component, depends in rows:
             sources[package] = source
             p2c[package] = component
             if depends is not None:
                 deps[package] = depends
-            # Maintain a counter for each virtual package.  If a
-            # Provides: exists, set the counter to 0 and count all
-            # provides by a package not in the list for removal.
-            # If the counter stays 0 at the end, we know that only
-            # the to-be-removed packages provided this virtual
-            # package.
-            if provides is not None:
-                for virtual_pkg in provides.split(","):
-                    virtual_pkg = virtual_pkg.strip()
-                    if virtual_pkg == package:
-                        continue
-                    if virtual_pkg not in virtual_packages:
-                        virtual_packages[virtual_pkg] = 0
-                    if package not in removals:
-                        virtual_packages[virtual_pkg] += 1
-
-        # If a virtual package is only provided by the to-be-removed
-        # packages, treat the virtual package as to-be-removed too.
-        removal_set.update(virtual_pkg for virtual_pkg in virtual_packages if not virtual_packages[virtual_pkg])
 
         # Check binary dependencies (Depends)
         for package in deps:
             if package in removals:
                 continue
             try:
-                parsed_dep = apt_pkg.parse_depends(deps[package])
+                parsed_dep = parse_depends(deps[package])
             except ValueError as e:
                 print("Error for package %s: %s" % (package, e))
                 parsed_dep = []
@@ -1100,11 +1397,7 @@ def check_reverse_depends(removals: Iterable[str], suite: str, arches: Optional[
                 # Check for partial breakage.  If a package has a ORed
                 # dependency, there is only a dependency problem if all
                 # packages in the ORed depends will be removed.
-                unsat = 0
-                for dep_package, _, _ in dep:
-                    if dep_package in removals:
-                        unsat += 1
-                if unsat == len(dep):
+                if all(dep_package in removals for dep_package, _, _ in dep):
                     component = p2c[package]
                     source = sources[package]
                     if component != "main":
@@ -1113,10 +1406,7 @@ def check_reverse_depends(removals: Iterable[str], suite: str, arches: Optional[
                     dep_problem = True
 
     if all_broken and not quiet:
-        if cruft:
-            print("  - broken Depends:")
-        else:
-            print("# Broken Depends:")
+        broken = []
         for source, bindict in sorted(all_broken.items()):
             lines = []
             for binary, arches in sorted(bindict.items()):
@@ -1124,17 +1414,8 @@ def check_reverse_depends(removals: Iterable[str], suite: str, arches: Optional[
                     lines.append(binary)
                 else:
                     lines.append('%s [%s]' % (binary, ' '.join(sorted(arches))))
-            if cruft:
-                print('    %s: %s' % (source, lines[0]))
-            else:
-                print('%s: %s' % (source, lines[0]))
-            for line in lines[1:]:
-                if cruft:
-                    print('    ' + ' ' * (len(source) + 2) + line)
-                else:
-                    print(' ' * (len(source) + 2) + line)
-        if not cruft:
-            print()
+            broken.append((source, lines))
+        _print_broken("Depends", broken, cruft)
 
     # Check source dependencies (Build-Depends and Build-Depends-Indep)
     all_broken = defaultdict(set)
@@ -1160,29 +1441,31 @@ def check_reverse_depends(removals: Iterable[str], suite: str, arches: Optional[
            GROUP BY s.id, s.source''')
     query = session.query(sql.column('source'), sql.column('build_dep')) \
         .from_statement(statement).params(params)
+    # Components of all sources in the override suite, fetched on the
+    # first breakage found
+    dsc_components = None
     for source, build_dep in query:
         if source in removals:
             continue
         parsed_dep = []
         if build_dep is not None:
             # Remove [arch] information since we want to see breakage on all arches
-            build_dep = re_build_dep_arch.sub("", build_dep)
+            if '[' in build_dep:
+                build_dep = re_build_dep_arch.sub("", build_dep)
             try:
                 parsed_dep = apt_pkg.parse_src_depends(build_dep)
             except ValueError as e:
                 print("Error for source %s: %s" % (source, e))
         for dep in parsed_dep:
-            unsat = 0
-            for dep_package, _, _ in dep:
-                if dep_package in removals:
-                    unsat += 1
-            if unsat == len(dep):
-                component, = session.query(Component.component_name) \
-                    .join(Component.overrides) \
-                    .filter(Override.suite == overridesuite) \
-                    .filter(Override.package == re.sub('/(contrib|non-free-firmware|non-free)$', '', source)) \
-                    .join(Override.overridetype).filter(OverrideType.overridetype == 'dsc') \
-                    .first()
+            if all(dep_package in removals for dep_package, _, _ in dep):
+                if dsc_components is None:
+                    dsc_components = dict(
+                        session.query(Override.package, Component.component_name)
+                        .join(Override.component)
+                        .join(Override.overridetype)
+                        .filter(Override.suite == overridesuite)
+                        .filter(OverrideType.overridetype == 'dsc'))
+                component = dsc_components.get(_re_nonmain_component_suffix.sub('', source))
                 key = source
                 if component != "main":
                     key = "%s/%s" % (source, component)
@@ -1190,23 +1473,8 @@ def check_reverse_depends(removals: Iterable[str], suite: str, arches: Optional[
                 dep_problem = True
 
     if all_broken and not quiet:
-        if cruft:
-            print("  - broken Build-Depends:")
-        else:
-            print("# Broken Build-Depends:")
-        for source, bdeps in sorted(all_broken.items()):
-            bdeps = sorted(bdeps)
-            if cruft:
-                print('    %s: %s' % (source, bdeps[0]))
-            else:
-                print('%s: %s' % (source, bdeps[0]))
-            for bdep in bdeps[1:]:
-                if cruft:
-                    print('    ' + ' ' * (len(source) + 2) + bdep)
-                else:
-                    print(' ' * (len(source) + 2) + bdep)
-        if not cruft:
-            print()
+        broken = [(source, sorted(bdeps)) for source, bdeps in sorted(all_broken.items())]
+        _print_broken("Build-Depends", broken, cruft)
 
     return dep_problem
 
@@ -1268,30 +1536,48 @@ def find_possibly_compressed_file(filename: str) -> str:
 ################################################################################
 
 
+_user_boolean_values = {
+    'yes': True, 'true': True, 'enable': True, 'enabled': True,
+    'no': False, 'false': False, 'disable': False, 'disabled': False,
+}
+
+
 def parse_boolean_from_user(value: str) -> bool:
     value = value.lower()
-    if value in {'yes', 'true', 'enable', 'enabled'}:
-        return True
-    if value in {'no', 'false', 'disable', 'disabled'}:
-        return False
-    raise ValueError("Not sure whether %s should be a True or a False" % value)
+    result = _user_boolean_values.get(value)
+    if result is None:
+        raise ValueError("Not sure whether %s should be a True or a False" % value)
+    return result
+
+
+@functools.lru_cache(maxsize=1)
+def _suite_suffix_config() -> tuple[str, Optional[frozenset[str]]]:
+    suffix = Cnf.find('Dinstall::SuiteSuffix', '')
+    if 'Dinstall::SuiteSuffixSuites' not in Cnf:
+        return suffix, None
+    return suffix, frozenset(Cnf.value_list('Dinstall::SuiteSuffixSuites'))
 
 
 def suite_suffix(suite_name: str) -> str:
     """Return suite_suffix for the given suite"""
-    suffix = Cnf.find('Dinstall::SuiteSuffix', '')
+    suffix, suites = _suite_suffix_config()
     if suffix == '':
         return ''
-    elif 'Dinstall::SuiteSuffixSuites' not in Cnf:
+    elif suites is None:
         # TODO: warn (once per run) that SuiteSuffix will be deprecated in the future
         return suffix
-    elif suite_name in Cnf.value_list('Dinstall::SuiteSuffixSuites'):
+    elif suite_name in suites:
         return suffix
     return ''
 
 ################################################################################
 
 
+@functools.lru_cache(maxsize=1)
+def _buildinfo_archive_dir() -> Optional[str]:
+    return Cnf['Dir::BuildinfoArchive'] if 'Dir::BuildinfoArchive' in Cnf else None
+
+
 def process_buildinfos(directory: str, buildinfo_files: 'Iterable[daklib.upload.HashedFile]', fs_transaction: 'daklib.fstransactions.FilesystemTransaction', logger: 'daklib.daklog.Logger') -> None:
     """Copy buildinfo files into Dir::BuildinfoArchive
 
@@ -1301,17 +1587,19 @@ def process_buildinfos(directory: str, buildinfo_files: 'Iterable[daklib.upload.
     :param logger: logger instance
     """
 
-    if 'Dir::BuildinfoArchive' not in Cnf:
+    buildinfo_archive = _buildinfo_archive_dir()
+    if buildinfo_archive is None:
         return
 
     target_dir = os.path.join(
-        Cnf['Dir::BuildinfoArchive'],
-        datetime.datetime.now().strftime('%Y/%m/%d'),
+        buildinfo_archive,
+        datetime.date.today().strftime('%Y/%m/%d'),
     )
 
+    existing = _listdir_set(target_dir)
     for f in buildinfo_files:
         src = os.path.join(directory, f.filename)
-        dst = find_next_free(os.path.join(target_dir, f.filename))
+        dst = _find_next_free_in(existing, os.path.join(target_dir, f.filename))
 
         logger.log(["Archiving", f.filename])
         fs_transaction.copy(src, dst, mode=0o644)
@@ -1319,6 +1607,12 @@ def process_buildinfos(directory: str, buildinfo_files: 'Iterable[daklib.upload.
 ################################################################################
 
 
+@functools.lru_cache(maxsize=1)
+def _morgue_dir() -> str:
+    return Cnf.get("Dir::Morgue", os.path.join(
+        Cnf.get("Dir::Base"), 'morgue'))
+
+
 def move_to_morgue(morguesubdir: str, filenames: Iterable[str], fs_transaction: 'daklib.fstransactions.FilesystemTransaction', logger: 'daklib.daklog.Logger'):
     """Move a file to the correct dir in morgue
 
@@ -1328,21 +1622,17 @@ def move_to_morgue(morguesubdir: str, filenames: Iterable[str], fs_transaction:
     :param logger: logger instance
     """
 
-    morguedir = Cnf.get("Dir::Morgue", os.path.join(
-        Cnf.get("Dir::Base"), 'morgue'))
-
     # Build directory as morguedir/morguesubdir/year/month/day
-    now = datetime.datetime.now()
-    dest = os.path.join(morguedir,
+    today = datetime.date.today()
+    dest = os.path.join(_morgue_dir(),
                         morguesubdir,
-                        str(now.year),
-                        '%.2d' % now.month,
-                        '%.2d' % now.day)
+                        f'{today.year:04d}',
+                        f'{today.month:02d}',
+                        f'{today.day:02d}')
 
+    existing = _listdir_set(dest)
     for filename in filenames:
-        dest_filename = dest + '/' + os.path.basename(filename)
         # If the destination file exists; try to find another filename to use
-        if os.path.lexists(dest_filename):
-            dest_filename = find_next_free(dest_filename)
+        dest_filename = _find_next_free_in(existing, dest + '/' + os.path.basename(filename))
         logger.log(["move to morgue", filename, dest_filename])
         fs_transaction.move(filename, dest_filename)
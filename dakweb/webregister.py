@@ -6,22 +6,27 @@
 
 
 class QueryRegister:
-    __shared_state = {}
-
-    def __init__(self, *args, **kwargs):
-        self.__dict__ = self.__shared_state
-
-        if not getattr(self, 'initialised', False):
-            self.initialised = True
+    # QueryRegister() always returns this one instance
+    _instance = None
 
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            instance = super().__new__(cls)
             # Dictionary of query paths to help mappings
-            self.queries = {}
+            instance.queries = {}
+            # Sorted query paths, None after a new path was registered
+            instance._sorted_paths = None
+            cls._instance = instance
+        return cls._instance
 
     def register_path(self, path, func):
         self.queries[path] = func.__module__
+        self._sorted_paths = None
 
     def get_paths(self):
-        return sorted(self.queries.keys())
+        if self._sorted_paths is None:
+            self._sorted_paths = sorted(self.queries.keys())
+        return list(self._sorted_paths)
 
     def get_path_help(self, path):
         # We always register with the leading /
@@ -6,7 +6,8 @@ import os
 from os.path import join
 
 from daklib.dbconn import *
-from daklib.queue import get_suite_version_by_source, get_suite_version_by_package
+from daklib.queue import get_suite_version_by_source, get_suite_version_by_package, \
+    get_suite_version_by_sources, get_suite_version_by_packages
 
 from sqlalchemy.orm.exc import MultipleResultsFound
 import unittest
@@ -45,6 +46,11 @@ class PackageTestCase(DBDakTestCase):
         # flush to make sure that the setup is correct
         self.session.flush()
 
+    def test_get_suites(self):
+        suites = get_suites(['sid', 'lenny', 'unknown'], session=self.session)
+        self.assertEqual({'sid': self.suite['sid'], 'lenny': self.suite['lenny']}, suites)
+        self.assertEqual({}, get_suites([], session=self.session))
+
     def test_suite_architecture(self):
         # check the id for architectures source and all
         self.assertEqual(1, self.arch['source'].arch_id)
@@ -172,6 +178,17 @@ class PackageTestCase(DBDakTestCase):
         self.assertTrue(('squeeze', '3.03-16') in result)
         self.assertTrue(('sid', '3.03-16') in result)
 
+    def test_get_suite_version_by_sources(self):
+        'test function get_suite_version_by_sources()'
+
+        result = get_suite_version_by_sources(['hello', 'sl', 'nonexistent'], self.session)
+        self.assertEqual(2, len(result))
+        self.assertEqual(sorted(get_suite_version_by_source('hello', self.session)),
+                         sorted(result['hello']))
+        self.assertEqual(sorted(get_suite_version_by_source('sl', self.session)),
+                         sorted(result['sl']))
+        self.assertFalse('nonexistent' in result)
+
     def test_binaries(self):
         '''
         tests class DBBinary; TODO: test relation with Architecture, Maintainer,
@@ -213,6 +230,17 @@ class PackageTestCase(DBDakTestCase):
             'python-hello', 'amd64', self.session)
         self.assertEqual([('squeeze', '2.2-1')], result)
 
+    def test_get_suite_version_by_packages(self):
+        'test function get_suite_version_by_packages()'
+
+        result = get_suite_version_by_packages(['hello', 'python-hello'], 'i386', self.session)
+        self.assertEqual(2, len(result))
+        self.assertTrue(('sid', '2.2-1') in result['hello'])
+        self.assertEqual([('squeeze', '2.2-1')], result['python-hello'])
+        result = get_suite_version_by_packages(['hello', 'python-hello'], 'amd64', self.session)
+        self.assertEqual(1, len(result))
+        self.assertEqual([('squeeze', '2.2-1')], result['python-hello'])
+
     def test_components(self):
         'test class Component'
 
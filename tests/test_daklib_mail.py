@@ -0,0 +1,80 @@
+#! /usr/bin/env python3
+#
+# License: GPL-2+
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import email.message
+import email.parser
+import email.policy
+
+from base_test import DakTestCase
+
+import daklib.mail
+
+
+def _make_part(payload: str, **headers) -> email.message.MIMEPart:
+    part = email.message.MIMEPart()
+    part.set_content(payload)
+    for name, value in headers.items():
+        part[name.replace('_', '-')] = value
+    return part
+
+
+def _parse_part(text: str) -> email.message.MIMEPart:
+    parser = email.parser.Parser(_class=email.message.MIMEPart, policy=email.policy.default)
+    return parser.parsestr(text)
+
+
+class TestCanonicalBytes(DakTestCase):
+    def assertCanonical(self, part):
+        self.assertEqual(daklib.mail._canonical_bytes(part),
+                         part.as_bytes(policy=email.policy.SMTP))
+
+    def test_plain(self):
+        self.assertCanonical(_make_part("hello\nworld\n"))
+
+    def test_no_trailing_newline(self):
+        self.assertCanonical(_make_part("hello\nworld"))
+        part = email.message.MIMEPart()
+        part['Content-Type'] = 'text/plain'
+        part.set_payload("no newline at the end")
+        self.assertCanonical(part)
+
+    def test_line_endings(self):
+        part = email.message.MIMEPart()
+        part['Content-Type'] = 'text/plain'
+        part.set_payload("a\r\nb\rc\n\r\nd\n")
+        self.assertCanonical(part)
+
+    def test_long_headers(self):
+        self.assertCanonical(_make_part("body\n", X_Long="word " * 60))
+        self.assertCanonical(_make_part("body\n", X_Long="x" * 200))
+
+    def test_folded_headers(self):
+        self.assertCanonical(_parse_part("Content-Type: text/plain\nX-Folded: foo\n bar\n\nbody\n"))
+        self.assertCanonical(_parse_part("Content-Type: text/plain\nX-Folded: " + "word " * 30 + "\n\tbar\n\nbody"))
+
+    def test_non_ascii(self):
+        self.assertCanonical(_make_part("héllo\n"))
+        self.assertCanonical(_make_part("body\n", X_Name="Jörg"))
+        part = _make_part("héllo\n")
+        del part['Content-Transfer-Encoding']
+        part['Content-Transfer-Encoding'] = '8bit'
+        self.assertCanonical(part)
+
+    def test_multipart(self):
+        part = _make_part("text part\n")
+        part.add_attachment(b"\x00\x01", maintype='application', subtype='octet-stream')
+        self.assertCanonical(part)
@@ -94,6 +94,11 @@ class ParseChangesTestCase(ParseChangesTestCase):
                 )
                 self.assertFalse(changes.get('you'))
 
+    def test_missing_fields(self):
+        # All missing fields are reported, not just the first one
+        with self.assertRaisesRegex(ParseChangesError, "'Format', 'Date', .*'Changes', 'Files'"):
+            self.assertParse('dsc/9.dsc', -1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -17,14 +17,27 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import apt_pkg
+import json
+import os
+import tempfile
 import unittest
 from base_test import DakTestCase
 
 from daklib.utils import (is_in_debug_section,
                           parse_built_using,
                           extract_component_from_section,
+                          build_file_list,
+                          TemplateSubst,
+                          open_next_free,
+                          _find_next_free_in,
+                          _load_mail_whitelist,
+                          _keyring_state,
+                          _load_key_address_cache,
+                          _store_key_address_cache,
                           _gpg_get_addresses_from_listing,
-                          ArchKey)
+                          _gpg_get_addresses_by_fingerprint,
+                          ArchKey,
+                          arch_sort_key)
 
 apt_pkg.init()
 
@@ -52,6 +65,12 @@ class UtilsTest(DakTestCase):
         assert arch1.__lt__(arch2)
         assert not arch2.__lt__(arch1)
 
+    def test_arch_sort_key(self):
+        archs = ['i386', 'source', 'all', 'amd64']
+        expected = ['source', 'all', 'amd64', 'i386']
+        self.assertEqual(sorted(archs, key=arch_sort_key), expected)
+        self.assertEqual(sorted(archs, key=arch_sort_key), sorted(archs, key=ArchKey))
+
     def test_is_in_debug_section(self):
         data = [
             (
@@ -121,6 +140,116 @@ class UtilsTest(DakTestCase):
         for v, r in data:
             self.assertEqual(extract_component_from_section(v), r)
 
+    def test_build_file_list_skips_blank_lines(self):
+        changes = {
+            'files': (
+                '0123 10 hello_1.0.orig.tar.gz\n'
+                '\n'
+                '4567 20 hello_1.0-1.debian.tar.xz\n'
+            ),
+        }
+        files = build_file_list(changes, is_a_dsc=True)
+        self.assertEqual(sorted(files), ['hello_1.0-1.debian.tar.xz', 'hello_1.0.orig.tar.gz'])
+        self.assertEqual(files['hello_1.0.orig.tar.gz'],
+                         {'size': '10', 'section': '-', 'priority': '-',
+                          'component': 'main', 'md5sum': '0123'})
+
+    def test_TemplateSubst(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.template') as fh:
+            fh.write("To: __MAINTAINER__\nSubject: __SOURCE__ __VERSION__\n__SOURCE___SUFFIX\n")
+            fh.flush()
+            subst = {
+                '__MAINTAINER__': 'Jane Doe <jane@example.org>',
+                '__SOURCE__': 'hello',
+                '__SOURCE___SUFFIX': 'hello-suffix',
+                '__VERSION__': 1,
+            }
+            self.assertEqual(TemplateSubst(subst, fh.name),
+                             "To: Jane Doe <jane@example.org>\nSubject: hello 1\nhello-suffix\n")
+
+    def test_open_next_free(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, 'mail')
+            paths = []
+            for _ in range(3):
+                fd, path = open_next_free(dest)
+                os.close(fd)
+                paths.append(path)
+            self.assertEqual(paths, [dest, dest + '.0', dest + '.1'])
+
+    def test_find_next_free_in(self):
+        existing = {'a.deb', 'a.deb.0'}
+        self.assertEqual(_find_next_free_in(existing, '/morgue/b.deb'), '/morgue/b.deb')
+        self.assertEqual(_find_next_free_in(existing, '/morgue/a.deb'), '/morgue/a.deb.1')
+        self.assertEqual(_find_next_free_in(existing, '/morgue/a.deb'), '/morgue/a.deb.2')
+        self.assertEqual(existing, {'a.deb', 'a.deb.0', 'a.deb.1', 'a.deb.2', 'b.deb'})
+
+    def _load_whitelist(self, tmpdir, name, lines):
+        path = os.path.join(tmpdir, name)
+        with open(path, 'w') as fh:
+            fh.write("".join(line + "\n" for line in lines))
+        return _load_mail_whitelist(path)
+
+    def test_load_mail_whitelist(self):
+        def matches(whitelist, address):
+            return any(pattern.match(address) for pattern in whitelist)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # plain entries are combined into a single pattern
+            whitelist = self._load_whitelist(tmpdir, 'combined', [
+                "# comment",
+                "john@example.org",
+                r"RE:.*@lists\.example\.org",
+            ])
+            self.assertEqual(len(whitelist), 1)
+            self.assertTrue(matches(whitelist, "john@example.org"))
+            self.assertTrue(matches(whitelist, "devel@lists.example.org"))
+            self.assertFalse(matches(whitelist, "John@Example.org"))
+            self.assertFalse(matches(whitelist, "jane@example.org"))
+
+            # a global flag must only apply to its own entry
+            whitelist = self._load_whitelist(tmpdir, 'flags', [
+                "john@example.org",
+                r"RE:(?i)bob@example\.org",
+            ])
+            self.assertEqual(len(whitelist), 2)
+            self.assertTrue(matches(whitelist, "Bob@Example.org"))
+            self.assertFalse(matches(whitelist, "John@Example.org"))
+
+            # entries with groups are kept separate as well
+            whitelist = self._load_whitelist(tmpdir, 'groups', [
+                "john@example.org",
+                r"RE:(bob|alice)@example\.org",
+            ])
+            self.assertEqual(len(whitelist), 2)
+            self.assertTrue(matches(whitelist, "alice@example.org"))
+
+    def test_key_address_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            keyring = os.path.join(tmpdir, 'keyring.gpg')
+            open(keyring, 'w').close()
+            state = _keyring_state([keyring])
+            addresses = {'AC6DFC4B78223BFCC1C064004847924E3DEDDF1E': ['jane@example.org']}
+
+            path = os.path.join(tmpdir, 'key-addresses.json')
+            _store_key_address_cache(path, state, addresses)
+            self.assertEqual(_load_key_address_cache(path, state), addresses)
+
+            # unexpected content is ignored
+            for content in ('[]', '"text"', '{"keyrings": %s, "addresses": []}' % json.dumps(state)):
+                with open(path, 'w') as fh:
+                    fh.write(content)
+                self.assertEqual(_load_key_address_cache(path, state), {})
+
+            # a missing keyring disables the cache instead of failing
+            self.assertIsNone(_keyring_state([keyring, os.path.join(tmpdir, 'missing.gpg')]))
+
+            # so does a cache file that cannot be written
+            path = os.path.join(tmpdir, 'missing', 'key-addresses.json')
+            _store_key_address_cache(path, state, addresses)
+            self.assertEqual(_load_key_address_cache(path, state), {})
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['key-addresses.json', 'keyring.gpg'])
+
     def test_gpg_get_addresses_from_listing(self):
         # Test with output containing a uid encoded in Latin-1 and UTF-8 each
         data = (
@@ -137,6 +266,27 @@ class UtilsTest(DakTestCase):
         expected = ['mustermann-soeder@example.org', 'mustermann-soeder@example.com']
         self.assertEqual(addresses, expected)
 
+    def test_gpg_get_addresses_by_fingerprint(self):
+        data = (
+            b"tru::1:1610798976:1673870895:3:1:5\n"
+            b"pub:u:3072:1:4847924E3DEDDF1E:1610798895:1673870895::u:::scESC::::::23::0:\n"
+            b"fpr:::::::::AC6DFC4B78223BFCC1C064004847924E3DEDDF1E:\n"
+            b"uid:u::::1610798895::F60CF610557A38E2943DECEEA5B02EE57B1ECC24::Jane Doe <jane@example.org>::::::::::0:\n"
+            b"sub:u:3072:1:C3BCC6A42035DDB3:1610798895:1673870895:::::e::::::23:\n"
+            b"fpr:::::::::C2CC5D5744746B5E7F5F7286C3BCC6A42035DDB3:\n"
+            b"pub:u:3072:1:1D4AB6BD4AB8A446:1610798895:1673870895::u:::scESC::::::23::0:\n"
+            b"fpr:::::::::0123456789ABCDEF01231D4AB6BD4AB8A446:\n"
+            b"uid:u::::1610798964::1D4AB6BD4AB8A446C196A1801F367B83B6141CC0::John Doe <john@example.com>::::::::::0:\n"
+        )
+
+        addresses = _gpg_get_addresses_by_fingerprint(data)
+        expected = {
+            'AC6DFC4B78223BFCC1C064004847924E3DEDDF1E': ['jane@example.org'],
+            'C2CC5D5744746B5E7F5F7286C3BCC6A42035DDB3': ['jane@example.org'],
+            '0123456789ABCDEF01231D4AB6BD4AB8A446': ['john@example.com'],
+        }
+        self.assertEqual(addresses, expected)
+
 
 if __name__ == '__main__':
     unittest.main()